@@ -1,7 +1,9 @@
 import os
 
 from helpers.utils import format_date, tzone, today, user_data_dir, search_dict_key
-from helpers.utils import cached_request, download_file, batch, in_thread, thread_pool
+from helpers.utils import cached_request, batch
+from helpers.fetch import fetch_pool
+from helpers.download import DownloadQueue
 
 
 class ScoresApi:
@@ -15,18 +17,21 @@ class ScoresApi:
     self.feedm_url = 'feedmonster.onefootball.com/feeds/il/en/competitions'
     self.image_url = 'images.onefootball.com/icons/teams'
     self.img_path  = "%s/images/" % user_data_dir()
+    self.crests    = DownloadQueue(self.data, content_types=['image/'], checksum=True)
 
     self.create_images_folder()
 
   def get(self, url, base_url, key=None, **kwargs):
     kwargs = {
-      'url':       url,
-      'cache':     self.cache,
-      'base_url':  base_url,
-      'json':      True,
-      'ttl':       kwargs.get('ttl', 1800),
-      'params':    kwargs.get('params'),
-      'cache_key': kwargs.get('cache_key')
+      'url':         url,
+      'cache':       self.cache,
+      'base_url':    base_url,
+      'json':        True,
+      'ttl':         kwargs.get('ttl', 1800),
+      'stale':       kwargs.get('stale', 0),
+      'params':      kwargs.get('params'),
+      'cache_key':   kwargs.get('cache_key'),
+      'stats_depth': 8
     }
 
     response = cached_request(**kwargs)
@@ -36,10 +41,10 @@ class ScoresApi:
     return response
 
   def get_sections(self):
-    return self.get(url='en.json', base_url=self.sconf_url, key='sections')
+    return self.get(url='en.json', base_url=self.sconf_url, key='sections', stale=86400)
 
   def get_competitions(self):
-    return self.get(url='en.json', base_url=self.sconf_url, key='competitions')
+    return self.get(url='en.json', base_url=self.sconf_url, key='competitions', stale=86400)
 
   def save_competitions(self):
     codes = self.get_sections()
@@ -71,7 +76,9 @@ class ScoresApi:
 
   def get_teams(self):
     comps = self.data.load_active_competitions(True)
-    items = thread_pool(self.get_competition_teams, list(comps))
+
+    with self.cache.batch_writes():
+      items = fetch_pool(self.get_competition_teams, comps, host=self.feedm_url)
 
     return items
 
@@ -100,6 +107,7 @@ class ScoresApi:
       'key':       ['data', 'matchdays'],
       'cache_key': 'competitions',
       'ttl':       60,
+      'stale':     600,
       'params':    {
         'competitions': comp_ids,
         'since':        today('%Y-%m-%d'),
@@ -119,33 +127,37 @@ class ScoresApi:
   def get_matches(self):
     settings = self.data.load_active_competitions()
     comp_ids = batch(settings, 2, ',')
-    combined = thread_pool(self.get_matchdays, comp_ids)
+
+    with self.cache.batch_writes():
+      combined = fetch_pool(self.get_matchdays, comp_ids, host=self.score_url)
 
     return combined
 
   def save_matches(self):
     matches = self.get_matches()
+    comps   = self.data.lookup_ids('competition')
+    teams   = self.data.lookup_ids('team')
     items   = []
 
     for item in matches:
       try:
-        competition = self.data.get_single('competition', { 'api_id': item['competition']['id'] })
-        home_team   = self.data.get_single('team', { 'api_id': item['team_home']['id'] })
-        away_team   = self.data.get_single('team', { 'api_id': item['team_away']['id'] })
+        competition = comps[item['competition']['id']]
+        home_team   = teams[item['team_home']['id']]
+        away_team   = teams[item['team_away']['id']]
         form_date   = format_date(date=item['kickoff'], localize=True)
 
         items.append({
           'date':        form_date,
           'minute':      item['minute'],
           'period':      item['period'],
-          'home_team':   home_team.id,
-          'away_team':   away_team.id,
+          'home_team':   home_team,
+          'away_team':   away_team,
           'score_home':  item['score_home'],
           'score_away':  item['score_away'],
-          'competition': competition.id,
+          'competition': competition,
           'api_id':      item['id']
         })
-      except (AttributeError, KeyError):
+      except (AttributeError, KeyError, TypeError):
         pass
 
     self.data.set_multiple('fixture', items, 'api_id')
@@ -156,7 +168,8 @@ class ScoresApi:
       'url':       'matches/updates',
       'key':       ['data', 'match_updates'],
       'cache_key': 'live',
-      'ttl':       10
+      'ttl':       10,
+      'stale':     0
     }
 
     return self.get(**kwargs)
@@ -179,11 +192,11 @@ class ScoresApi:
 
     self.data.set_multiple('fixture', items, 'api_id')
 
-  def save_crests(self):
+  def save_crests(self, callback=None):
     teams = self.data.load_teams()
+    items = [(team.crest_url, team.crest_path) for team in teams]
 
-    for team in teams:
-      in_thread(target=self.download_team_crest, args=[team])
+    return self.crests.put_many(items, callback)
 
   def section_name(self, codes, code):
     name = list(filter(lambda ccode: ccode['key'] == code, codes))
@@ -204,12 +217,3 @@ class ScoresApi:
   def create_images_folder(self):
     if not os.path.exists(self.img_path):
       os.makedirs(self.img_path)
-
-  def download_team_crest(self, team):
-    link = team.crest_url
-    path = team.crest_path
-
-    if not os.path.exists(path):
-      path = download_file(link, path)
-
-    return path
@@ -1,7 +1,7 @@
 from operator import itemgetter
-from lxml import html
 from fuzzywuzzy import fuzz
-from helpers.utils import cached_request, thread_pool, replace_all
+from helpers.utils import cached_request, replace_all
+from helpers.fetch import fetch_pool
 
 
 class StreamsApi:
@@ -10,14 +10,11 @@ class StreamsApi:
     self.data  = data
     self.cache = cache
 
-  def get(self, url='', ttl=3600):
-    base_url = 'livefootballol.me'
-    response = cached_request(url=url, cache=self.cache, base_url=base_url, ttl=ttl)
+    self.base_url = 'livefootballol.me'
 
-    try:
-      response = html.fromstring(response)
-    except TypeError:
-      response = None
+  def get(self, url='', ttl=3600, stale=0):
+    base_url = self.base_url
+    response = cached_request(url=url, cache=self.cache, base_url=base_url, ttl=ttl, stale=stale, html=True)
 
     return response
 
@@ -43,7 +40,9 @@ class StreamsApi:
 
   def get_channels_links(self):
     pages = self.get_channels_pages()
-    items = thread_pool(self.get_channels_page_links, pages)
+
+    with self.cache.batch_writes():
+      items = fetch_pool(self.get_channels_page_links, pages, host=self.base_url)
 
     return items
 
@@ -91,7 +90,9 @@ class StreamsApi:
 
   def get_channels(self):
     links = self.get_channels_links()
-    items = thread_pool(self.get_channel_details, links)
+
+    with self.cache.batch_writes():
+      items = fetch_pool(self.get_channel_details, links, host=self.base_url)
 
     return items
 
@@ -121,7 +122,7 @@ class StreamsApi:
 
   def get_events_page_links(self):
     link  = self.get_events_page()
-    data  = self.get(url=link, ttl=120)
+    data  = self.get(url=link, ttl=120, stale=600)
     items = []
 
     if data is not None:
@@ -131,7 +132,7 @@ class StreamsApi:
     return items
 
   def get_event_channels(self, url):
-    data  = self.get(url=url, ttl=60)
+    data  = self.get(url=url, ttl=60, stale=600)
     items = []
 
     if data is None:
@@ -165,12 +166,14 @@ class StreamsApi:
 
   def get_events(self):
     links = self.get_events_page_links()
-    items = thread_pool(self.get_event_channels, links)
+
+    with self.cache.batch_writes():
+      items = fetch_pool(self.get_event_channels, links, host=self.base_url)
 
     return items
 
   def save_events(self):
-    fixtures = self.data.load_fixtures(today_only=True)
+    fixtures = self.data.load_fixtures(today_only=True, related=True)
     events   = self.get_events()
     items    = []
 
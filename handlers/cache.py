@@ -1,89 +1,428 @@
 import json
+import time
+import atexit
+import threading
+import traceback
+import contextvars
 
+from datetime import timedelta
+from contextlib import contextmanager
+from collections import OrderedDict
+from lxml import html, etree
 from playhouse.sqlite_ext import CharField, DateTimeField, IntegerField
+from playhouse.migrate import SqliteMigrator, migrate
 
-from peewee import IntegrityError, Model
-from helpers.utils import database_connection
+from peewee import IntegrityError, Model, Case, SQL, fn
+from helpers.utils import database_connection, batch
 from helpers.utils import now
 
+CACHE_BATCH = contextvars.ContextVar('cache_batch', default=None)
+
 
 class CacheHandler(object):
 
-  def __init__(self):
-    self.dbs = database_connection('cache.db')
+  def __init__(self, memory_size=128, max_size=64 * 1024 * 1024, evict_interval=600,
+               evict_grace=86400, fail_ttl=30, fail_max_ttl=3600, stats_path=None):
+    self.dbs   = database_connection('cache.db')
+    self.stats = CacheStats(stats_path)
+
     self.register_models()
 
+    self.memory_size = memory_size
+    self.memory      = OrderedDict()
+    self.memory_lock = threading.Lock()
+
+    self.max_size       = max_size
+    self.evict_interval = evict_interval
+    self.evict_grace    = evict_grace
+    self.evict_event    = threading.Event()
+    self.accessed       = {}
+
+    self.fail_ttl     = fail_ttl
+    self.fail_max_ttl = fail_max_ttl
+    self.failures     = {}
+
+    self.start_eviction()
+
   def register_models(self):
-    self.dbs.connect()
+    self.dbs.connect(reuse_if_open=True)
     self.dbs.create_tables([Cacheable], safe=True)
+    self.migrate_models()
+
+  def migrate_models(self):
+    columns  = [column.name for column in self.dbs.get_columns('cacheable')]
+    migrator = SqliteMigrator(self.dbs)
+    changes  = []
+
+    for name in ['accessed', 'etag', 'modified']:
+      if name not in columns:
+        field = getattr(Cacheable, name)
+        changes.append(migrator.add_column('cacheable', name, field))
+
+    if changes:
+      migrate(*changes)
+
+  def enable_incremental_vacuum(self):
+    mode = self.dbs.execute_sql('PRAGMA auto_vacuum').fetchone()
+
+    if mode is None or mode[0] != 2:
+      self.dbs.execute_sql('PRAGMA auto_vacuum = INCREMENTAL')
+      self.dbs.execute_sql('VACUUM')
 
   def get(self, key):
+    item = self.batched(key)
+    item = item if item is not None else self.memory_get(key)
+
+    if item is not None:
+      self.touch(key)
+      return item
+
+    start = time.monotonic()
+
     try:
       item = Cacheable.get(key=key)
+      self.memory_set(item)
+      self.touch(key)
     except Cacheable.DoesNotExist:
       item = None
 
-    return item
-
-  def create(self, key, value, ttl=0):
-    try:
-      item = Cacheable.create(key=key, value=value.strip(), ttl=ttl)
-    except IntegrityError:
-      item = None
+    self.stats.lookup(key, time.monotonic() - start)
 
     return item
 
-  def update(self, item, value, ttl=0):
+  def refresh(self, item, ttl=0):
     kwargs = {
-      'value':   value.strip(),
       'ttl':     ttl,
       'updated': now()
     }
 
+    return self.update_fields(item, kwargs)
+
+  def update_fields(self, item, kwargs):
     try:
       query = Cacheable.update(**kwargs).where(Cacheable.key == item.key)
       query.execute()
+
+      for name, field in kwargs.items():
+        setattr(item, name, field)
+
+      if 'value' in kwargs:
+        item.decodes = {}
+        self.stats.stored(item.key, len(kwargs['value']))
+
+      self.memory_set(item)
     except IntegrityError:
       pass
 
     return item
 
-  def load(self, key):
+  def load(self, key, max_stale=0):
     item = self.get(key)
 
-    if self.is_valid(item):
+    if self.is_valid(item, max_stale):
       return item
 
     return None
 
-  def save(self, key, value, ttl=0):
-    item = self.get(key)
+  def save(self, key, value, ttl=0, etag=None, modified=None):
+    kwargs = {
+      'key':      key,
+      'value':    value.strip(),
+      'ttl':      ttl,
+      'etag':     etag,
+      'modified': modified,
+      'updated':  now()
+    }
+
+    item = Cacheable(**kwargs)
+    self.memory_set(item)
+
+    batch = CACHE_BATCH.get()
+
+    with self.memory_lock:
+      if batch is not None and batch['open']:
+        batch['items'][key] = item
+        return item
 
-    if item is None:
-      item = self.create(key, value, ttl)
-    else:
-      item = self.update(item, value, ttl)
+    self.upsert([item])
 
     return item
 
-  def is_valid(self, item):
+  def save_many(self, items):
+    for subset in batch(list(items), 100):
+      self.upsert(subset)
+
+  def upsert(self, items):
+    fields = [Cacheable.key, Cacheable.value, Cacheable.ttl, Cacheable.etag, Cacheable.modified]
+    fields = fields + [Cacheable.created, Cacheable.updated]
+    values = [[item.key, item.value, item.ttl, item.etag, item.modified, item.updated, item.updated] for item in items]
+
+    if not items:
+      return
+
+    try:
+      query = Cacheable.insert_many(values, fields=fields)
+      query = query.on_conflict(conflict_target=[Cacheable.key], preserve=fields[1:5] + fields[6:])
+      self.dbs.execute(query).fetchall()
+    except IntegrityError:
+      return
+
+    for item in items:
+      self.stats.stored(item.key, len(item.value))
+
+  @contextmanager
+
+  def batch_writes(self):
+    if CACHE_BATCH.get() is not None:
+      yield self
+      return
+
+    batch = { 'open': True, 'items': {} }
+    token = CACHE_BATCH.set(batch)
+
+    try:
+      yield self
+    finally:
+      CACHE_BATCH.reset(token)
+
+      with self.memory_lock:
+        batch['open'] = False
+
+      self.flush_batch(batch['items'])
+
+  def flush_batch(self, items):
+    try:
+      self.save_many(items.values())
+    except Exception:
+      traceback.print_exc()
+
+  def batched(self, key):
+    batch = CACHE_BATCH.get()
+
+    if batch is None:
+      return None
+
+    with self.memory_lock:
+      return batch['items'].get(key)
+
+  def is_valid(self, item, max_stale=0):
     try:
       diff = (now() - item.updated).total_seconds()
 
-      if abs(diff) < abs(item.ttl):
+      if abs(diff) < abs(item.ttl) + max_stale:
         return True
     except AttributeError:
       pass
 
     return False
 
+  def memory_get(self, key):
+    with self.memory_lock:
+      item = self.memory.get(key)
+
+      if item is not None:
+        self.memory.move_to_end(key)
+
+    return item
+
+  def memory_set(self, item):
+    if self.memory_size <= 0:
+      return
+
+    with self.memory_lock:
+      self.memory[item.key] = item
+      self.memory.move_to_end(item.key)
+
+      while len(self.memory) > self.memory_size:
+        self.memory.popitem(last=False)
+
+  def memory_clear(self, key=None):
+    with self.memory_lock:
+      if key is None:
+        self.memory.clear()
+      else:
+        self.memory.pop(key, None)
+
+  def fail(self, key):
+    with self.memory_lock:
+      count = self.failures.get(key, { 'count': 0 })['count'] + 1
+      delay = min(self.fail_ttl * 2 ** (count - 1), self.fail_max_ttl)
+      until = now() + timedelta(seconds=delay)
+
+      self.failures[key] = { 'count': count, 'until': until }
+
+  def failed(self, key):
+    with self.memory_lock:
+      failure = self.failures.get(key)
+
+    return failure is not None and failure['until'] > now()
+
+  def clear_failure(self, key):
+    with self.memory_lock:
+      self.failures.pop(key, None)
+
+  def touch(self, key):
+    with self.memory_lock:
+      self.accessed[key] = now()
+
+  def flush_accessed(self):
+    with self.memory_lock:
+      accessed      = self.accessed
+      self.accessed = {}
+
+    for subset in batch(list(accessed.items()), 300):
+      dates = Case(Cacheable.key, subset)
+      query = Cacheable.update(accessed=dates).where(Cacheable.key << [key for key, _date in subset])
+      query.execute()
+
+  def start_eviction(self):
+    if self.evict_interval <= 0:
+      return
+
+    thread = threading.Thread(target=self.run_eviction, daemon=True)
+    thread.start()
+
+  def stop_eviction(self):
+    self.evict_event.set()
+
+  def run_eviction(self):
+    self.enable_incremental_vacuum()
+
+    while not self.evict_event.wait(self.evict_interval):
+      self.evict()
+
+  def evict(self):
+    self.flush_accessed()
+    self.evict_expired()
+    self.evict_oversize()
+    self.vacuum()
+
+  def evict_expired(self):
+    expiry = Cacheable.ttl + self.evict_grace
+    expiry = fn.julianday(Cacheable.updated) + expiry / SQL('86400.0')
+    items  = Cacheable.select(Cacheable.key).where(expiry < fn.julianday('now', 'localtime'))
+    keys   = list(sum(items.tuples(), ()))
+
+    self.delete_keys(keys)
+
+  def evict_oversize(self):
+    if self.max_size <= 0:
+      return
+
+    recent = fn.coalesce(Cacheable.accessed, Cacheable.updated)
+    items  = Cacheable.select(Cacheable.key, fn.length(Cacheable.value))
+    items  = items.order_by(recent.desc()).tuples()
+    total  = 0
+    keys   = []
+
+    for key, size in items:
+      total = total + int(size or 0)
+
+      if total > self.max_size:
+        keys.append(key)
+
+    self.delete_keys(keys)
+
+  def delete_keys(self, keys):
+    for subset in batch(keys, 500):
+      Cacheable.delete().where(Cacheable.key << subset).execute()
+
+      for key in subset:
+        self.memory_clear(key)
+
+  def vacuum(self, pages=1000):
+    self.dbs.execute_sql("PRAGMA incremental_vacuum(%d)" % pages)
+
+
+class CacheStats(object):
+
+  def __init__(self, path=None, depth=3):
+    self.depth   = depth
+    self.lock    = threading.Lock()
+    self.buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+    self.items   = {}
+
+    if path is not None:
+      self.dump_on_exit(path)
+
+  def prefix(self, key, depth=None):
+    parts = [part for part in str(key).split(':') if not part.isdigit()]
+    parts = parts[:depth or self.depth]
+
+    return ':'.join(parts)
+
+  def entry(self, key, depth=None):
+    name = self.prefix(key, depth)
+
+    if name not in self.items:
+      self.items[name] = {
+        'hits':   0,
+        'misses': 0,
+        'stale':  0,
+        'bytes':  0,
+        'fetch':  self.histogram(),
+        'lookup': self.histogram()
+      }
+
+    return self.items[name]
+
+  def histogram(self):
+    return { 'count': 0, 'total': 0.0, 'buckets': [0] * (len(self.buckets) + 1) }
+
+  def increment(self, key, name, value=1, depth=None):
+    with self.lock:
+      self.entry(key, depth)[name] += value
+
+  def observe(self, key, name, seconds, depth=None):
+    index = len([bucket for bucket in self.buckets if bucket < seconds])
+
+    with self.lock:
+      histogram = self.entry(key, depth)[name]
+      histogram['count'] += 1
+      histogram['total'] += seconds
+      histogram['buckets'][index] += 1
+
+  def hit(self, key, depth=None):
+    self.increment(key, 'hits', depth=depth)
+
+  def miss(self, key, depth=None):
+    self.increment(key, 'misses', depth=depth)
+
+  def stale(self, key, depth=None):
+    self.increment(key, 'stale', depth=depth)
+
+  def stored(self, key, size, depth=None):
+    self.increment(key, 'bytes', size, depth=depth)
+
+  def fetch(self, key, seconds, depth=None):
+    self.observe(key, 'fetch', seconds, depth)
+
+  def lookup(self, key, seconds, depth=None):
+    self.observe(key, 'lookup', seconds, depth)
+
+  def snapshot(self):
+    with self.lock:
+      data = json.loads(json.dumps(self.items))
+
+    return { 'buckets': self.buckets + ['inf'], 'prefixes': data }
+
+  def dump_on_exit(self, path):
+    atexit.register(self.dump, path)
+
+  def dump(self, path):
+    with open(path, 'w') as filename:
+      json.dump(self.snapshot(), filename, indent=2, sort_keys=True)
+
 
 class Cacheable(Model):
-  key     = CharField(unique=True)
-  value   = CharField()
-  ttl     = IntegerField(default=0)
-  created = DateTimeField(default=now())
-  updated = DateTimeField(default=now())
+  key      = CharField(unique=True)
+  value    = CharField()
+  ttl      = IntegerField(default=0)
+  created  = DateTimeField(default=now())
+  updated  = DateTimeField(default=now())
+  accessed = DateTimeField(null=True)
+  etag     = CharField(null=True)
+  modified = CharField(null=True)
 
   class Meta:
     database = database_connection('cache.db')
@@ -96,7 +435,35 @@ class Cacheable(Model):
   @property
 
   def json(self):
+    return self.decoded('json', self.decode_json)
+
+  @property
+
+  def html(self):
+    return self.decoded('html', self.decode_html)
+
+  def decoded(self, kind, decoder):
+    if not hasattr(self, 'decodes'):
+      self.decodes = {}
+
+    value, data = self.decodes.get(kind, (None, None))
+
+    if value is None or value is not self.value:
+      data = decoder()
+      self.decodes[kind] = (self.value, data)
+
+    return data
+
+  def decode_json(self):
     data = '[]' if self.value is None else str(self.value)
     data = json.loads(data)
 
     return data
+
+  def decode_html(self):
+    try:
+      data = html.fromstring(self.text)
+    except (TypeError, etree.ParserError):
+      data = None
+
+    return data
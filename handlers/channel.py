@@ -1,11 +1,11 @@
 import gi
-import time
 
 gi.require_version('Gtk', '3.0')
 gi.require_version('GLib', '2.0')
 
 from gi.repository import Gtk, GLib
-from helpers.utils import in_thread, relative_path
+from helpers.utils import relative_path, request_deadline
+from helpers.executor import run_task
 from helpers.gtk import remove_widget_children, set_scroll_position, run_generator
 
 from widgets.channelbox import ChannelBox
@@ -18,6 +18,9 @@ class ChannelHandler(object):
     self.app    = app
     self.stack  = app.channels_stack
     self.filter = None
+    self.token  = None
+
+    self.update_deadline = 300
 
     self.channels = Gtk.Builder()
     self.channels.add_from_file(relative_path('ui/channels.ui'))
@@ -42,7 +45,7 @@ class ChannelHandler(object):
       self.update_channels_data()
 
   def do_initial_setup(self):
-    in_thread(target=self.initial_setup)
+    run_task(self.initial_setup)
 
   def do_channels_widgets(self):
     if not self.channels_filters.get_children():
@@ -59,17 +62,24 @@ class ChannelHandler(object):
       run_generator(self.update_channels_list)
 
   def update_channels_data(self):
-    in_thread(target=self.do_update_channels_data)
+    if self.token is not None:
+      self.token.cancel()
+
+    kwargs = { 'lane': 'ui', 'callback': self.on_channels_data_updated }
+    self.token = run_task(self.do_update_channels_data, **kwargs)
 
   def do_update_channels_data(self):
     GLib.idle_add(self.app.toggle_reload, False)
 
-    self.app.streams_api.save_channels()
-    time.sleep(5)
+    with request_deadline(self.update_deadline):
+      self.app.streams_api.save_channels()
+
+    self.app.data.flush()
 
-    GLib.idle_add(self.do_channels_widgets)
-    GLib.idle_add(self.update_channels_widgets)
-    GLib.idle_add(self.app.toggle_reload, True)
+  def on_channels_data_updated(self, *_args):
+    self.do_channels_widgets()
+    self.update_channels_widgets()
+    self.app.toggle_reload(True)
 
   def do_channels_filters(self):
     filters = self.app.data.load_channels_filters()
@@ -96,7 +106,7 @@ class ChannelHandler(object):
       yield True
 
   def do_channels_list(self):
-    channels = self.app.data.load_channels(True)
+    channels = self.app.data.load_channels(active=True, related=True)
     remove_widget_children(self.channels_list)
 
     for channel in channels:
@@ -108,12 +118,12 @@ class ChannelHandler(object):
     self.channels_list.add(channbox)
 
   def update_channels_list(self):
-    channels = self.app.data.load_channels(True, True)
+    channels = self.app.data.load_channels(active=True, related=True)
+    channels = dict((channel.id, channel) for channel in channels)
 
     for item in self.channels_list.get_children():
       if item.channel.id in channels:
-        updated = self.app.data.get_single('channel', { 'id': item.channel.id })
-        item.set_property('channel', updated)
+        item.set_property('channel', channels[item.channel.id])
       else:
         item.destroy()
 
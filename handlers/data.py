@@ -1,19 +1,34 @@
 import os
+import threading
 
 from playhouse.sqlite_ext import CharField, IntegerField, BooleanField
 from playhouse.sqlite_ext import DateTimeField, ForeignKeyField
 
-from peewee import IntegrityError, Model
-from helpers.utils import database_connection, relative_path
+from datetime import timedelta
+from peewee import IntegrityError, Model, fn
+from helpers.utils import database_connection, relative_path, batch, merge_dicts
 from helpers.utils import query_date_range, parse_date, format_date, now, today
 
 
 class DataHandler(object):
 
-  def __init__(self):
+  def __init__(self, fixture_days=30, event_days=1, stream_days=7, prune_interval=3600, prune_batch=500):
     self.dbs = database_connection('data.db')
     self.register_models()
 
+    self.lookups     = {}
+    self.lookup_lock = threading.Lock()
+
+    self.fixture_days   = fixture_days
+    self.event_days     = event_days
+    self.stream_days    = stream_days
+    self.prune_interval = prune_interval
+    self.prune_batch    = prune_batch
+    self.prune_event    = threading.Event()
+    self.touch_models   = [Stream]
+
+    self.start_pruning()
+
   @property
 
   def fx_query(self):
@@ -33,10 +48,63 @@ class DataHandler(object):
     return query
 
   def register_models(self):
-    tables = [Setting, Competition, Team, Fixture, Channel, Stream, Event]
+    tables = [Setting, Competition, Team, Fixture, Channel, Stream, Event, Download]
 
-    self.dbs.connect()
+    self.dbs.connect(reuse_if_open=True)
     self.dbs.create_tables(tables, safe=True)
+    self.migrate_models()
+
+  def migrate_models(self):
+    version = self.dbs.execute_sql('PRAGMA user_version').fetchone()[0]
+    pending = SCHEMA_MIGRATIONS[version:]
+
+    for index, statements in enumerate(pending, version + 1):
+      for statement in statements:
+        self.dbs.execute_sql(statement).fetchall()
+
+      self.dbs.execute_sql("PRAGMA user_version = %d" % index).fetchall()
+
+    if pending:
+      self.dbs.execute_sql('ANALYZE').fetchall()
+
+  def explain_query(self, query):
+    sql, params = query.sql()
+    plan = self.dbs.execute_sql("EXPLAIN QUERY PLAN %s" % sql, params).fetchall()
+    plan = [str(row[-1]) for row in plan]
+
+    return plan
+
+  def explain_queries(self):
+    queries = {
+      'load_settings':                 self.load_settings(),
+      'load_active_competitions':      self.load_active_competitions(True),
+      'load_competitions':             self.load_competitions(),
+      'load_competitions[current]':    self.load_competitions(current=True),
+      'load_teams':                    self.load_teams(),
+      'load_fixtures':                 self.load_fixtures(),
+      'load_fixtures[current]':        self.load_fixtures(current=True),
+      'load_fixtures[today_only]':     self.load_fixtures(today_only=True),
+      'load_languages':                self.languages_query(),
+      'load_channels':                 self.load_channels(),
+      'load_channels[active]':         self.load_channels(active=True),
+      'prefetch_streams':              self.streams_query([0]),
+      'prefetch_events_count':         self.events_count_query([0]),
+      'fixture_events':                Fixture(id=0).events,
+      'channel_streams':               Channel(id=0).streams
+    }
+
+    return dict((name, self.explain_query(query)) for name, query in queries.items())
+
+  def full_scans(self, plans=None):
+    plans = self.explain_queries() if plans is None else plans
+    scans = []
+
+    for name, plan in sorted(plans.items()):
+      for line in plan:
+        if line.startswith('SCAN') and 'USING' not in line:
+          scans.append("%s: %s" % (name, line))
+
+    return scans
 
   def get_model(self, model):
     try:
@@ -110,9 +178,192 @@ class DataHandler(object):
 
     return items
 
-  def set_multiple(self, model, items, main_key):
+  def set_multiple(self, model, items, main_key, chunk_size=100):
+    model  = self.get_model(model)
+    counts = { 'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0 }
+    items  = [item for item in items if item.get(main_key) is not None]
+
+    for chunk in batch(items, chunk_size):
+      self.upsert_chunk(model, chunk, main_key, counts)
+
+    return counts
+
+  def upsert_chunk(self, model, items, main_key, counts):
+    fields   = model_fields(model)
+    column   = getattr(model, main_key)
+    keys     = [item[main_key] for item in items]
+    existing = model.select().where(column << keys).dicts()
+    existing = dict((row[main_key], row) for row in existing)
+
+    self.update_lookup(model, main_key, existing)
+    inserts  = {}
+    updates  = {}
+    touches  = []
+
     for item in items:
-      self.set_single(model, item, main_key)
+      item = dict((name, field_value(fields[name], value)) for name, value in item.items() if name in fields)
+      row  = existing.get(item[main_key])
+
+      if row is None:
+        row = new_row(fields, item)
+
+        if row is None:
+          counts['skipped'] += 1
+        else:
+          inserts[item[main_key]] = row
+      elif any(row[name] != value for name, value in item.items()):
+        row = merge_dicts(row, item)
+        row['updated'] = now()
+
+        updates[item[main_key]] = row
+      else:
+        counts['unchanged'] += 1
+        touches.append(item[main_key])
+
+    inserted = self.execute_upsert(model, list(inserts.values()), main_key, False)
+    updated  = self.execute_upsert(model, list(updates.values()), main_key, True)
+
+    counts['inserted'] += inserted
+    counts['updated']  += updated
+    counts['skipped']  += len(inserts) + len(updates) - inserted - updated
+
+    if touches and model in self.touch_models:
+      model.update(updated=now()).where(column << touches).execute()
+
+    if inserts:
+      self.clear_lookup(model, main_key)
+
+  def execute_upsert(self, model, rows, main_key, update):
+    fields  = model_fields(model)
+    columns = [field for name, field in fields.items() if name != 'id']
+    written = 0
+
+    for subset in batch(rows, max(1, 999 // len(columns))):
+      values = [[row.get(field.name) for field in columns] for row in subset]
+      query  = model.insert_many(values, fields=columns)
+      query  = query.on_conflict_ignore() if not update else query.on_conflict(
+        conflict_target=[fields[main_key]], preserve=columns
+      )
+
+      try:
+        written = written + model._meta.database.execute(query).rowcount
+      except IntegrityError:
+        if len(subset) > 1:
+          written = written + sum(self.execute_upsert(model, [row], main_key, update) for row in subset)
+
+    return written
+
+  def flush(self, timeout=None):
+    cursor = self.dbs.execute_sql('PRAGMA user_version', timeout=timeout)
+    cursor.fetchall()
+
+    return True
+
+  def start_pruning(self):
+    if self.prune_interval <= 0:
+      return
+
+    thread = threading.Thread(target=self.run_pruning, daemon=True)
+    thread.start()
+
+  def stop_pruning(self):
+    self.prune_event.set()
+
+  def run_pruning(self):
+    while not self.prune_event.is_set():
+      self.prune()
+      self.prune_event.wait(self.prune_interval)
+
+  def prune(self):
+    counts = {
+      'events':   self.prune_events(),
+      'fixtures': self.prune_fixtures(),
+      'streams':  self.prune_streams(),
+      'orphans':  self.prune_orphans()
+    }
+
+    if counts['fixtures']:
+      self.clear_lookup(Fixture)
+
+    if counts['streams']:
+      self.clear_lookup(Stream)
+
+    if any(counts.values()):
+      self.dbs.execute_sql('PRAGMA optimize')
+
+    return counts
+
+  def prune_rows(self, model, query):
+    total = 0
+
+    while not self.prune_event.is_set():
+      subset = query.select(model.id).limit(self.prune_batch)
+      count  = model.delete().where(model.id << subset).execute()
+      total  = total + count
+
+      if count < self.prune_batch:
+        break
+
+    return total
+
+  def prune_events(self):
+    limit = now() - timedelta(days=self.event_days)
+    query = Event.select().join(Fixture)
+    query = query.where((Fixture.date < limit) & (Fixture.period << ['FullTime', 'Postponed']))
+
+    return self.prune_rows(Event, query)
+
+  def prune_fixtures(self):
+    limit = now() - timedelta(days=self.fixture_days)
+    items = Fixture.select(Fixture.id).where(Fixture.date < limit)
+    self.prune_rows(Event, Event.select().where(Event.fixture << items))
+
+    return self.prune_rows(Fixture, Fixture.select().where(Fixture.date < limit))
+
+  def prune_streams(self):
+    limit = now() - timedelta(days=self.stream_days)
+    query = Stream.select().where(fn.coalesce(Stream.watched, Stream.updated) < limit)
+    query = query.where(Stream.id.not_in(Event.select(Event.stream)))
+
+    return self.prune_rows(Stream, query)
+
+  def prune_orphans(self):
+    query = Event.select().where(Event.fixture.not_in(Fixture.select(Fixture.id)))
+    total = self.prune_rows(Event, query)
+    query = Event.select().where(Event.stream.not_in(Stream.select(Stream.id)))
+
+    return total + self.prune_rows(Event, query)
+
+  def lookup_ids(self, model, key='api_id'):
+    model = self.get_model(model) if isinstance(model, str) else model
+    name  = (model_table(model), key)
+
+    with self.lookup_lock:
+      items = self.lookups.get(name)
+
+    if items is None:
+      self.flush()
+
+      items = model.select(getattr(model, key), model.id).tuples()
+      items = dict(items)
+
+      with self.lookup_lock:
+        self.lookups[name] = items
+
+    return items
+
+  def update_lookup(self, model, key, rows):
+    name = (model_table(model), key)
+
+    with self.lookup_lock:
+      if name in self.lookups:
+        self.lookups[name].update((value, row['id']) for value, row in rows.items())
+
+  def clear_lookup(self, model, key=None):
+    with self.lookup_lock:
+      for name in list(self.lookups):
+        if name[0] == model_table(model) and key in (None, name[1]):
+          self.lookups.pop(name)
 
   def load_settings(self):
     return Setting.select()
@@ -143,31 +394,101 @@ class DataHandler(object):
   def load_teams(self):
     return Team.select()
 
-  def load_fixtures(self, current=False, id_only=False, today_only=False):
+  def load_fixtures(self, current=False, id_only=False, today_only=False, related=False):
     items = Fixture.select().distinct()
     items = items.order_by(Fixture.date, Fixture.competition)
     items = items.where(Fixture.competition << self.load_active_competitions(True))
     items = items if not current else items.where(self.fx_query)
     items = items if not today_only else items.where(self.fl_query)
     items = items if not id_only else list(sum(items.select(Fixture.id).tuples(), ()))
+    items = items if not related else self.prefetch_related(items, ['competition', 'home_team', 'away_team'])
+    items = items if not related else self.prefetch_events_count(items)
+
+    return items
+
+  def prefetch_events_count(self, items):
+    ids    = [item.id for item in items]
+    counts = dict(self.events_count_query(ids).tuples()) if ids else {}
+
+    for item in items:
+      item.events_total = counts.get(item.id, 0)
+
+    return items
+
+  def events_count_query(self, ids):
+    query = Event.select(Event.fixture, fn.COUNT(Event.id)).where(Event.fixture << ids)
+    query = query.group_by(Event.fixture)
+
+    return query
+
+  def prefetch_related(self, items, names):
+    items  = list(items)
+    groups = {}
+
+    if not items:
+      return items
+
+    for name in names:
+      field = model_fields(type(items[0]))[name]
+      group = groups.setdefault(field.rel_model, { 'names': [], 'ids': set() })
+
+      group['names'].append(name)
+      group['ids'].update(getattr(item, "%s_id" % name) for item in items)
+
+    for model, group in groups.items():
+      related = model.select().where(model.id << list(group['ids']))
+      related = dict((item.id, item) for item in related)
+
+      for item in items:
+        for name in group['names']:
+          value = related.get(getattr(item, "%s_id" % name))
+
+          if value is not None:
+            setattr(item, name, value)
 
     return items
 
+  def languages_query(self):
+    return Channel.select(Channel.language).join(Stream).distinct()
+
   def load_languages(self):
-    items = Channel.select(Channel.language).join(Stream)
-    items = items.distinct().tuples()
+    items = self.languages_query().tuples()
     items = sorted(list(set(sum(items, ()))))
 
     return items
 
-  def load_channels(self, active=False, id_only=False):
+  def load_channels(self, active=False, id_only=False, related=False):
     items = Channel.select()
     items = items if not active else items.join(Stream)
     items = items.order_by(Channel.name).distinct()
     items = items if not id_only else list(sum(items.select(Channel.id).tuples(), ()))
+    items = items if not related else self.prefetch_streams(items)
+
+    return items
+
+  def prefetch_streams(self, items, limit=2):
+    items   = list(items)
+    ids     = [item.id for item in items]
+    streams = self.streams_query(ids) if ids else []
+    grouped = {}
+
+    for stream in streams:
+      group = grouped.setdefault(stream.channel_id, [])
+
+      if len(group) < limit:
+        group.append(stream)
+
+    for item in items:
+      item.streams_list = grouped.get(item.id, [])
 
     return items
 
+  def streams_query(self, ids):
+    query = Stream.select().where(Stream.channel << ids)
+    query = query.order_by(Stream.channel, Stream.created, Stream.id)
+
+    return query
+
   def load_matches_filters(self, current=False):
     filters = self.load_competitions(True, True) if current else self.load_active_competitions(True, True)
     filters = ['All Competitions'] + filters if filters else []
@@ -181,6 +502,58 @@ class DataHandler(object):
     return filters
 
 
+SCHEMA_MIGRATIONS = [
+  [
+    'CREATE INDEX IF NOT EXISTS "fixture_date" ON "fixture" ("date")',
+    'CREATE INDEX IF NOT EXISTS "fixture_competition_id_date" ON "fixture" ("competition_id", "date")',
+    'CREATE INDEX IF NOT EXISTS "stream_channel_id_created" ON "stream" ("channel_id", "created")',
+    'CREATE INDEX IF NOT EXISTS "event_fixture_id_stream_id" ON "event" ("fixture_id", "stream_id")',
+    'CREATE INDEX IF NOT EXISTS "channel_language" ON "channel" ("language")'
+  ],
+  [
+    'DROP INDEX IF EXISTS "fixture_competition_id"',
+    'DROP INDEX IF EXISTS "stream_channel_id"',
+    'DROP INDEX IF EXISTS "event_fixture_id"'
+  ]
+]
+
+
+def model_table(model):
+  return getattr(model._meta, 'table_name', None) or model._meta.db_table
+
+
+def model_fields(model):
+  return model._meta.fields
+
+
+def field_value(field, value):
+  if isinstance(value, Model):
+    value = value.id
+
+  if value is None:
+    return None
+
+  return field.python_value(field.db_value(value))
+
+
+def new_row(fields, item):
+  row = {}
+
+  for name, field in fields.items():
+    if name in item:
+      row[name] = item[name]
+    elif name in ['created', 'updated']:
+      row[name] = now()
+    elif field.default is not None:
+      row[name] = field.default() if callable(field.default) else field.default
+    elif field.null or name == 'id':
+      row[name] = None
+    else:
+      return None
+
+  return row
+
+
 class BasicModel(Model):
 
   class Meta:
@@ -266,7 +639,7 @@ class Fixture(BasicModel):
   away_team   = ForeignKeyField(Team, related_name='away_team')
   score_home  = IntegerField(null=True)
   score_away  = IntegerField(null=True)
-  competition = ForeignKeyField(Competition, related_name='competition')
+  competition = ForeignKeyField(Competition, related_name='competition', index=False)
   api_id      = IntegerField(unique=True)
   created     = DateTimeField(default=now())
   updated     = DateTimeField(default=now())
@@ -278,6 +651,14 @@ class Fixture(BasicModel):
 
   @property
 
+  def events_count(self):
+    count = getattr(self, 'events_total', None)
+    count = self.events.count() if count is None else count
+
+    return count
+
+  @property
+
   def live(self):
     pastp = ['PreMatch', 'FullTime', 'Postponed']
     fdate = parse_date(date=self.date, localize=False).date()
@@ -332,8 +713,11 @@ class Channel(BasicModel):
   @property
 
   def streams(self):
-    streams = Stream.select().where(Stream.channel == self).limit(2)
-    streams = streams.distinct().order_by(Stream.created)
+    streams = getattr(self, 'streams_list', None)
+
+    if streams is None:
+      streams = Stream.select().where(Stream.channel == self).limit(2)
+      streams = streams.distinct().order_by(Stream.created)
 
     return streams
 
@@ -345,7 +729,7 @@ class Stream(BasicModel):
   url      = CharField()
   hd_url   = CharField(null=True)
   ch_id    = CharField(unique=True)
-  channel  = ForeignKeyField(Channel, related_name='channel')
+  channel  = ForeignKeyField(Channel, related_name='channel', index=False)
   watched  = DateTimeField(null=True)
   created  = DateTimeField(default=now())
   updated  = DateTimeField(default=now())
@@ -361,12 +745,26 @@ class Stream(BasicModel):
 
 class Event(BasicModel):
   fs_id   = CharField(unique=True)
-  fixture = ForeignKeyField(Fixture, related_name='fixture')
+  fixture = ForeignKeyField(Fixture, related_name='fixture', index=False)
   stream  = ForeignKeyField(Stream, related_name='stream')
   created = DateTimeField(default=now())
   updated = DateTimeField(default=now())
 
 
+class Download(BasicModel):
+  url      = CharField(unique=True)
+  path     = CharField()
+  status   = CharField(default='pending')
+  attempts = IntegerField(default=0)
+  created  = DateTimeField(default=now())
+  updated  = DateTimeField(default=now())
+
+  @property
+
+  def done(self):
+    return self.status == 'done' and os.path.exists(str(self.path))
+
+
 class StaticStream(object):
 
   def __init__(self, url):
@@ -1,11 +1,11 @@
 import gi
-import time
 
 gi.require_version('Gtk', '3.0')
 gi.require_version('GLib', '2.0')
 
 from gi.repository import Gtk, GLib
-from helpers.utils import now, in_thread, relative_path
+from helpers.utils import now, relative_path, request_deadline
+from helpers.executor import run_task
 from helpers.gtk import remove_widget_children, set_scroll_position, run_generator
 
 from widgets.matchbox import MatchBox, MatchTeamsBox, MatchStreamBox
@@ -18,6 +18,10 @@ class MatchHandler(object):
     self.app    = app
     self.stack  = app.matches_stack
     self.filter = None
+    self.token  = None
+
+    self.update_deadline = 120
+    self.live_deadline   = 60
 
     self.matches = Gtk.Builder()
     self.matches.add_from_file(relative_path('ui/matches.ui'))
@@ -64,11 +68,15 @@ class MatchHandler(object):
   def initial_setup(self):
     if not self.app.data.load_competitions():
       self.update_competitions_data()
+      self.app.data.flush()
+
       self.update_teams_data()
+      self.app.data.flush()
+
       self.update_matches_data()
 
   def do_initial_setup(self):
-    in_thread(target=self.initial_setup)
+    run_task(self.initial_setup)
 
   def do_matches_widgets(self):
     if not self.matches_filters.get_children():
@@ -96,37 +104,50 @@ class MatchHandler(object):
   def update_teams_data(self):
     if not self.app.data.load_teams():
       self.app.scores_api.save_teams()
-      self.app.scores_api.save_crests()
+      self.app.scores_api.save_crests(self.on_crests_ready)
+
+  def on_crests_ready(self, _paths):
+    GLib.idle_add(self.update_matches_widgets)
 
   def update_matches_data(self):
-    in_thread(target=self.do_update_matches_data)
+    if self.token is not None:
+      self.token.cancel()
+
+    kwargs = { 'lane': 'ui', 'callback': self.on_matches_data_updated }
+    self.token = run_task(self.do_update_matches_data, **kwargs)
 
   def do_update_matches_data(self):
     GLib.idle_add(self.app.toggle_reload, False)
 
-    self.update_events_data()
-    time.sleep(5)
+    with request_deadline(self.update_deadline):
+      self.update_events_data()
 
-    GLib.idle_add(self.do_matches_widgets)
-    GLib.idle_add(self.update_matches_widgets)
+    self.app.data.flush()
+
+  def on_matches_data_updated(self, *_args):
+    self.do_matches_widgets()
+    self.update_matches_widgets()
 
     if self.in_match:
-      GLib.idle_add(self.update_match_details)
+      self.update_match_details()
 
-    GLib.idle_add(self.app.toggle_reload, True)
+    self.app.toggle_reload(True)
 
   def update_live_data(self):
     if self.live_fixtures:
-      in_thread(target=self.do_update_live_data)
+      run_task(self.do_update_live_data, callback=self.on_live_data_updated)
 
     return True
 
   def do_update_live_data(self):
-    self.app.streams_api.save_events()
-    self.app.scores_api.save_live()
-    time.sleep(5)
+    with request_deadline(self.live_deadline):
+      self.app.streams_api.save_events()
+      self.app.scores_api.save_live()
 
-    GLib.idle_add(self.update_matches_widgets)
+    self.app.data.flush()
+
+  def on_live_data_updated(self, *_args):
+    self.update_matches_widgets()
 
   def do_matches_filters(self):
     filters = self.app.data.load_matches_filters()
@@ -160,7 +181,7 @@ class MatchHandler(object):
       yield True
 
   def do_matches_list(self):
-    fixtures = self.app.data.load_fixtures(True)
+    fixtures = self.app.data.load_fixtures(current=True, related=True)
     remove_widget_children(self.matches_list)
 
     for fixture in fixtures:
@@ -172,12 +193,12 @@ class MatchHandler(object):
     self.matches_list.add(matchbox)
 
   def update_matches_list(self):
-    fixtures = self.app.data.load_fixtures(True, True)
+    fixtures = self.app.data.load_fixtures(current=True, related=True)
+    fixtures = dict((fixture.id, fixture) for fixture in fixtures)
 
     for item in self.matches_list.get_children():
       if item.fixture.id in fixtures:
-        updated = self.app.data.get_single('fixture', { 'id': item.fixture.id })
-        item.set_property('fixture', updated)
+        item.set_property('fixture', fixtures[item.fixture.id])
       else:
         item.destroy()
 
@@ -2,7 +2,8 @@ import time
 import hashlib
 import pexpect
 
-from helpers.utils import in_thread, run_command, kill_proccess
+from helpers.utils import run_command, kill_proccess
+from helpers.executor import run_task
 
 
 class StreamHandler(object):
@@ -11,6 +12,7 @@ class StreamHandler(object):
     self.acestream = None
     self.url       = None
     self.session   = None
+    self.token     = None
 
   def notify(self, message):
     messages = {
@@ -28,8 +30,11 @@ class StreamHandler(object):
     self.player.url = None
     self.player.stop()
 
+    if self.token is not None:
+      self.token.cancel()
+
     self.player.loading = True
-    in_thread(target=self.open_stream, args=[url])
+    self.token = run_task(self.open_stream, args=[url], lane='ui')
 
   def close(self):
     self.stop_acestream()
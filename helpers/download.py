@@ -0,0 +1,115 @@
+import os
+import threading
+import traceback
+
+from helpers.utils import download_file, now
+from helpers.executor import run_task
+
+
+class DownloadQueue(object):
+
+  def __init__(self, data, retries=3, backoff=5, retry_failed=86400, **kwargs):
+    self.data         = data
+    self.options      = kwargs
+    self.retries      = retries
+    self.backoff      = backoff
+    self.retry_failed = retry_failed
+
+    self.lock      = threading.Lock()
+    self.urls      = set()
+    self.ready     = []
+    self.callbacks = []
+
+  def put(self, url, path):
+    with self.lock:
+      if url in self.urls:
+        return False
+
+      self.urls.add(url)
+
+    self.submit(url, path, 0)
+
+    return True
+
+  def put_many(self, items, callback=None):
+    items   = [(url, path) for url, path in items if None not in (url, path)]
+    records = self.data.get_multiple('download', 'url', set(url for url, _path in items))
+    records = dict((record.url, record) for record in records)
+    added   = []
+
+    with self.lock:
+      for url, path in items:
+        if url not in self.urls and not self.skip(path, records.get(url)):
+          self.urls.add(url)
+          added.append((url, path))
+
+      if callback is not None and self.urls:
+        self.callbacks.append(callback)
+
+    for url, path in added:
+      self.submit(url, path, 0)
+
+    return len(added)
+
+  def skip(self, path, record):
+    if os.path.exists(path):
+      return True
+
+    if record is None:
+      return False
+
+    if record.status == 'failed':
+      return abs((now() - record.updated).total_seconds()) < self.retry_failed
+
+    return record.done
+
+  def submit(self, url, path, attempt, delay=0):
+    run_task(self.download, args=[url, path, attempt], lane='download', delay=delay)
+
+  def download(self, url, path, attempt):
+    try:
+      result = download_file(url, path, **self.options)
+    except Exception:
+      traceback.print_exc()
+      result = None
+
+    if result is None and attempt + 1 < self.retries:
+      self.retry(url, path, attempt + 1)
+    else:
+      self.finish(url, path, result, attempt + 1)
+
+  def retry(self, url, path, attempt):
+    delay = self.backoff * 2 ** (attempt - 1)
+    self.submit(url, path, attempt, delay)
+
+  def finish(self, url, path, result, attempts):
+    record = {
+      'url':      url,
+      'path':     path,
+      'status':   'failed' if result is None else 'done',
+      'attempts': attempts,
+      'updated':  now()
+    }
+
+    try:
+      self.data.set_single('download', record, 'url')
+    except Exception:
+      traceback.print_exc()
+
+    with self.lock:
+      self.urls.discard(url)
+
+      if result is not None:
+        self.ready.append(result)
+
+      if self.urls:
+        return
+
+      ready     = self.ready
+      callbacks = self.callbacks
+
+      self.ready     = []
+      self.callbacks = []
+
+    for callback in callbacks:
+      callback(ready)
@@ -0,0 +1,156 @@
+import time
+import heapq
+import itertools
+import threading
+import traceback
+
+from collections import deque
+
+try:
+  import gi
+  gi.require_version('GLib', '2.0')
+  from gi.repository import GLib
+except (ImportError, ValueError):
+  GLib = None
+
+TASK_EXECUTOR = None
+TASK_LOCK     = threading.Lock()
+TASK_OPTIONS  = {
+  'workers':            5,
+  'background_workers': 2,
+  'download_workers':   2
+}
+
+
+class CancelToken(object):
+
+  def __init__(self):
+    self.event = threading.Event()
+
+  @property
+
+  def cancelled(self):
+    return self.event.is_set()
+
+  def cancel(self):
+    self.event.set()
+
+
+class Task(object):
+
+  def __init__(self, target, args=None, kwargs=None, callback=None, token=None):
+    self.target   = target
+    self.args     = args or []
+    self.kwargs   = kwargs or {}
+    self.callback = callback
+    self.token    = token or CancelToken()
+
+  def run(self):
+    if self.token.cancelled:
+      return
+
+    result = self.target(*self.args, **self.kwargs)
+
+    if self.callback is None or self.token.cancelled:
+      return
+
+    if GLib is None:
+      self.complete(result)
+    else:
+      GLib.idle_add(self.complete, result)
+
+  def complete(self, result):
+    if not self.token.cancelled:
+      self.callback(result)
+
+    return False
+
+
+class TaskExecutor(object):
+
+  def __init__(self, workers=5, background_workers=2, download_workers=2):
+    self.workers = workers
+    self.limits  = {
+      'ui':         workers,
+      'background': min(background_workers, workers),
+      'download':   min(download_workers, workers)
+    }
+
+    self.lanes   = dict((lane, deque()) for lane in self.limits)
+    self.running = dict((lane, 0) for lane in self.limits)
+    self.delayed = []
+    self.counter = itertools.count()
+    self.ready   = threading.Condition()
+
+    for _index in range(workers):
+      thread = threading.Thread(target=self.run_worker, daemon=True)
+      thread.start()
+
+  def submit(self, target, args=None, kwargs=None, lane='background', callback=None, token=None, delay=0):
+    task = Task(target, args, kwargs, callback, token)
+
+    with self.ready:
+      if delay > 0:
+        heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.counter), lane, task))
+      else:
+        self.lanes[lane].append(task)
+
+      self.ready.notify()
+
+    return task.token
+
+  def schedule_delayed(self):
+    current = time.monotonic()
+
+    while self.delayed and self.delayed[0][0] <= current:
+      _due, _index, lane, task = heapq.heappop(self.delayed)
+      self.lanes[lane].append(task)
+
+    return self.delayed[0][0] - current if self.delayed else None
+
+  def next_task(self):
+    for lane, tasks in self.lanes.items():
+      if tasks and self.running[lane] < self.limits[lane]:
+        self.running[lane] = self.running[lane] + 1
+        return lane, tasks.popleft()
+
+    return None, None
+
+  def run_worker(self):
+    while True:
+      with self.ready:
+        timeout    = self.schedule_delayed()
+        lane, task = self.next_task()
+
+        while task is None:
+          self.ready.wait(timeout)
+          timeout    = self.schedule_delayed()
+          lane, task = self.next_task()
+
+      try:
+        task.run()
+      except Exception:
+        traceback.print_exc()
+      finally:
+        with self.ready:
+          self.running[lane] = self.running[lane] - 1
+          self.ready.notify()
+
+
+def configure_tasks(**kwargs):
+  with TASK_LOCK:
+    TASK_OPTIONS.update(kwargs)
+
+
+def task_executor():
+  global TASK_EXECUTOR
+
+  with TASK_LOCK:
+    if TASK_EXECUTOR is None:
+      TASK_EXECUTOR = TaskExecutor(**TASK_OPTIONS)
+
+    return TASK_EXECUTOR
+
+
+def run_task(target, args=None, kwargs=None, lane='background', callback=None, token=None, delay=0):
+  return task_executor().submit(target, args, kwargs, lane, callback, token, delay)
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor
+from helpers.utils import flatten_list, deadline_remaining
+
+FETCH_ENGINE  = None
+FETCH_LOCK    = threading.Lock()
+FETCH_OPTIONS = {
+  'concurrency': 16,
+  'per_host':    8
+}
+
+
+class FetchEngine(object):
+
+  def __init__(self, concurrency=16, per_host=8):
+    self.concurrency = concurrency
+    self.per_host    = per_host
+    self.limits      = {}
+
+    self.executor = ThreadPoolExecutor(max_workers=concurrency)
+    self.loop     = asyncio.new_event_loop()
+    self.thread   = threading.Thread(target=self.run_loop, daemon=True)
+    self.thread.start()
+
+  def run_loop(self):
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_forever()
+
+  def stop(self):
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.executor.shutdown(wait=False)
+
+  def host_limit(self, host):
+    if host not in self.limits:
+      self.limits[host] = asyncio.Semaphore(self.per_host)
+
+    return self.limits[host]
+
+  async def fetch(self, callback, arg, host, context):
+    async with self.host_limit(host):
+      return await self.loop.run_in_executor(self.executor, context.run, callback, arg)
+
+  async def gather(self, callback, args, host, timeout, default):
+    tasks = []
+
+    for arg, context in args:
+      name = host(arg) if callable(host) else host
+      task = self.loop.create_task(self.fetch(callback, arg, name, context))
+      tasks.append(task)
+
+    if not tasks:
+      return []
+
+    await asyncio.wait(tasks, timeout=timeout)
+
+    for task in tasks:
+      if not task.done():
+        task.cancel()
+
+    return [self.result(task, default) for task in tasks]
+
+  def result(self, task, default):
+    if task.cancelled() or not task.done():
+      return default
+
+    if task.exception() is not None:
+      raise task.exception()
+
+    return task.result()
+
+  def map(self, callback, args, host=None, default=None):
+    args    = [(arg, contextvars.copy_context()) for arg in args]
+    timeout = deadline_remaining()
+    future  = self.gather(callback, args, host, timeout, default)
+    future  = asyncio.run_coroutine_threadsafe(future, self.loop)
+
+    return future.result()
+
+
+def configure_fetch(**kwargs):
+  global FETCH_ENGINE
+
+  with FETCH_LOCK:
+    FETCH_OPTIONS.update(kwargs)
+
+    if FETCH_ENGINE is not None:
+      FETCH_ENGINE.stop()
+      FETCH_ENGINE = None
+
+
+def fetch_engine():
+  global FETCH_ENGINE
+
+  with FETCH_LOCK:
+    if FETCH_ENGINE is None:
+      FETCH_ENGINE = FetchEngine(**FETCH_OPTIONS)
+
+    return FETCH_ENGINE
+
+
+def fetch_pool(callback, args, host=None, flatten=True, default=None):
+  default = [] if default is None and flatten else default
+  data    = fetch_engine().map(callback, list(args), host, default)
+
+  if flatten:
+    data = flatten_list(data)
+
+  return data
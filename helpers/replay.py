@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+def fixture_key(url, ignore_params=None):
+  parts  = urlsplit(url)
+  ignore = ignore_params or []
+  query  = [item for item in parse_qsl(parts.query) if item[0] not in ignore]
+  query  = urlencode(sorted(query))
+  url    = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+
+  return url
+
+
+def fixture_path(folder, url, ignore_params=None):
+  key  = fixture_key(url, ignore_params).encode('utf-8')
+  name = hashlib.sha1(key).hexdigest()
+
+  return os.path.join(folder, "%s.json" % name)
+
+
+class RecordAdapter(HTTPAdapter):
+
+  def __init__(self, folder, ignore_params=None, **kwargs):
+    HTTPAdapter.__init__(self, **kwargs)
+
+    self.folder        = folder
+    self.ignore_params = ignore_params
+    self.requests      = 0
+    self.lock          = threading.Lock()
+
+    if not os.path.exists(folder):
+      os.makedirs(folder)
+
+  def send(self, request, **kwargs):
+    kwargs['stream'] = False
+    response = HTTPAdapter.send(self, request, **kwargs)
+
+    with self.lock:
+      self.requests = self.requests + 1
+
+    if response.status_code == 200:
+      self.save(request, response)
+
+    return response
+
+  def save(self, request, response):
+    data = {
+      'url':     fixture_key(request.url, self.ignore_params),
+      'status':  response.status_code,
+      'headers': dict(response.headers),
+      'body':    response.content.decode('latin-1')
+    }
+
+    for name in ['Content-Encoding', 'Content-Length', 'Transfer-Encoding']:
+      data['headers'].pop(name, None)
+
+    with open(fixture_path(self.folder, request.url, self.ignore_params), 'w') as filename:
+      json.dump(data, filename)
+
+
+class ReplayAdapter(BaseAdapter):
+
+  def __init__(self, folder, latency=0, jitter=0, ignore_params=None):
+    BaseAdapter.__init__(self)
+
+    self.folder        = folder
+    self.latency       = latency
+    self.jitter        = jitter
+    self.ignore_params = ignore_params
+    self.requests      = 0
+    self.misses        = 0
+    self.lock          = threading.Lock()
+
+  def send(self, request, **kwargs):
+    delay = self.latency + random.uniform(0, self.jitter)
+    path  = fixture_path(self.folder, request.url, self.ignore_params)
+    data  = { 'status': 404, 'headers': {}, 'body': '' }
+
+    if delay > 0:
+      time.sleep(delay)
+
+    if os.path.exists(path):
+      with open(path) as filename:
+        data = json.load(filename)
+
+    with self.lock:
+      self.requests = self.requests + 1
+      self.misses   = self.misses + int(data['status'] == 404)
+
+    return self.build_response(request, data)
+
+  def build_response(self, request, data):
+    response = Response()
+    response.status_code = data['status']
+    response.headers     = CaseInsensitiveDict(data['headers'])
+    response._content    = data['body'].encode('latin-1')
+    response.encoding    = get_encoding_from_headers(response.headers)
+    response.url         = request.url
+    response.request     = request
+    response.reason      = 'OK' if data['status'] == 200 else 'Not Found'
+
+    response._content_consumed = True
+
+    return response
+
+  def close(self):
+    pass
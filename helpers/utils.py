@@ -1,16 +1,83 @@
 import os
+import json
 import time
 import socket
+import hashlib
+import tempfile
+import contextvars
 import psutil
 import subprocess
 import threading
 
-from multiprocessing.pool import ThreadPool
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 from datetime import datetime, timedelta, timezone
 from dateutil import parser
-from psutil import Popen, process_iter, cpu_count
-from requests import get
+from psutil import Popen, process_iter
+from requests import Session
+from requests.adapters import HTTPAdapter
 from playhouse.sqliteq import SqliteQueueDatabase
+from helpers.executor import run_task
+
+DATABASE_CONNECTIONS = {}
+DATABASE_LOCK        = threading.Lock()
+DATABASE_PRAGMAS     = {
+  'journal_mode': 'wal',
+  'synchronous':  'normal',
+  'mmap_size':    64 * 1024 * 1024,
+  'cache_size':   -8000,
+  'temp_store':   'memory'
+}
+
+REVALIDATE_KEYS = set()
+REVALIDATE_LOCK = threading.Lock()
+
+FLIGHT_CALLS = {}
+FLIGHT_LOCK  = threading.Lock()
+
+HTTP_SESSION = None
+HTTP_LOCK    = threading.Lock()
+HTTP_OPTIONS = {
+  'pool_connections': 10,
+  'pool_maxsize':     20,
+  'max_retries':      0,
+  'timeout':          (5, 30),
+  'rate_limit':       (20, 40),
+  'rate_limits':      {}
+}
+
+HTTP_BUCKETS  = {}
+HTTP_DEADLINE = contextvars.ContextVar('http_deadline', default=None)
+
+FILE_UMASK = os.umask(0o022)
+FILE_UMASK = os.umask(FILE_UMASK)
+
+
+class DeadlineExceeded(socket.timeout):
+  pass
+
+
+class TokenBucket(object):
+
+  def __init__(self, rate, burst):
+    self.rate    = float(rate)
+    self.burst   = float(burst)
+    self.tokens  = float(burst)
+    self.updated = time.monotonic()
+    self.lock    = threading.Lock()
+
+  def reserve(self):
+    with self.lock:
+      current      = time.monotonic()
+      self.tokens  = min(self.burst, self.tokens + (current - self.updated) * self.rate)
+      self.updated = current
+      self.tokens  = self.tokens - 1
+
+      return max(0.0, -self.tokens / self.rate)
+
+  def refund(self):
+    with self.lock:
+      self.tokens = min(self.burst, self.tokens + 1)
 
 
 def relative_path(filepath):
@@ -38,11 +105,34 @@ def database_dir(db_name):
   return db_dir
 
 
+def configure_database(**pragmas):
+  with DATABASE_LOCK:
+    DATABASE_PRAGMAS.update(pragmas)
+
+
+def database_pragmas():
+  path    = os.path.join(user_data_dir(), 'settings.json')
+  pragmas = DATABASE_PRAGMAS.copy()
+
+  try:
+    with open(path) as filename:
+      pragmas.update(json.load(filename).get('database_pragmas', {}))
+  except (OSError, ValueError, AttributeError):
+    pass
+
+  return pragmas
+
+
 def database_connection(db_name):
-  db_dir  = database_dir(db_name)
-  db_conn = SqliteQueueDatabase(db_dir)
+  with DATABASE_LOCK:
+    if db_name not in DATABASE_CONNECTIONS:
+      db_dir  = database_dir(db_name)
+      pragmas = list(database_pragmas().items())
+      db_conn = SqliteQueueDatabase(db_dir, pragmas=pragmas)
 
-  return db_conn
+      DATABASE_CONNECTIONS[db_name] = db_conn
+
+    return DATABASE_CONNECTIONS[db_name]
 
 
 def gmtime(date_format=None, round_time=False):
@@ -122,22 +212,28 @@ def batch(iterable, size=1, delimiter=None):
   return result
 
 
-def in_thread(**kwargs):
-  thread = threading.Thread(**kwargs)
-  thread.start()
+def single_flight(key, callback, *args):
+  with FLIGHT_LOCK:
+    flight = FLIGHT_CALLS.get(key)
+    leader = flight is None
 
+    if leader:
+      flight = { 'event': threading.Event(), 'result': None }
+      FLIGHT_CALLS[key] = flight
 
-def thread_pool(callback, args, flatten=True):
-  pool = ThreadPool(processes=cpu_count())
-  data = pool.map(callback, args)
+  if not leader:
+    flight['event'].wait(deadline_remaining())
+    return flight['result']
 
-  pool.close()
-  pool.join()
+  try:
+    flight['result'] = callback(*args)
+  finally:
+    with FLIGHT_LOCK:
+      FLIGHT_CALLS.pop(key, None)
 
-  if flatten:
-    data = flatten_list(data)
+    flight['event'].set()
 
-  return data
+  return flight['result']
 
 
 def run_command(args, **kwargs):
@@ -207,27 +303,219 @@ def replace_all(string, find, replace):
   return string
 
 
+def configure_http(**kwargs):
+  global HTTP_SESSION
+
+  with HTTP_LOCK:
+    HTTP_OPTIONS.update(kwargs)
+
+    HTTP_BUCKETS.clear()
+
+    if HTTP_SESSION is not None:
+      HTTP_SESSION.close()
+      HTTP_SESSION = None
+
+
+def http_session():
+  global HTTP_SESSION
+
+  with HTTP_LOCK:
+    if HTTP_SESSION is None:
+      adapter = HTTPAdapter(
+        pool_connections=HTTP_OPTIONS['pool_connections'],
+        pool_maxsize=HTTP_OPTIONS['pool_maxsize'],
+        max_retries=HTTP_OPTIONS['max_retries']
+      )
+
+      HTTP_SESSION = Session()
+      HTTP_SESSION.mount('http://', adapter)
+      HTTP_SESSION.mount('https://', adapter)
+
+    return HTTP_SESSION
+
+
+def mount_http_adapter(adapter):
+  session = http_session()
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+
+  return session
+
+
+def http_get(url, **kwargs):
+  timeout = kwargs.pop('timeout', HTTP_OPTIONS['timeout'])
+  timeout = deadline_timeout(timeout)
+
+  rate_limit(urlsplit(url).netloc)
+
+  return http_session().get(url, timeout=timeout, **kwargs)
+
+
+def http_bucket(host):
+  with HTTP_LOCK:
+    if host not in HTTP_BUCKETS:
+      limit = HTTP_OPTIONS['rate_limits'].get(host, HTTP_OPTIONS['rate_limit'])
+      HTTP_BUCKETS[host] = TokenBucket(*limit)
+
+    return HTTP_BUCKETS[host]
+
+
+def rate_limit(host):
+  bucket = http_bucket(host)
+  delay  = bucket.reserve()
+  remain = deadline_remaining()
+
+  if remain is not None and delay >= remain:
+    bucket.refund()
+    raise DeadlineExceeded('Request deadline exceeded')
+
+  if delay > 0:
+    time.sleep(delay)
+
+
+@contextmanager
+
+def request_deadline(seconds):
+  token = HTTP_DEADLINE.set(time.monotonic() + seconds)
+
+  try:
+    yield
+  finally:
+    HTTP_DEADLINE.reset(token)
+
+
+def deadline_remaining():
+  deadline = HTTP_DEADLINE.get()
+
+  if deadline is None:
+    return None
+
+  return max(0.0, deadline - time.monotonic())
+
+
+def deadline_timeout(timeout):
+  remain = deadline_remaining()
+
+  if remain is None:
+    return timeout
+
+  if remain <= 0:
+    raise DeadlineExceeded('Request deadline exceeded')
+
+  if isinstance(timeout, (tuple, list)):
+    return tuple(min(item, remain) for item in timeout)
+
+  return min(timeout, remain)
+
+
 def cached_request(url, cache, params=None, callback=None, **kwargs):
   url       = parse_url(url, kwargs.get('base_url'))
   cache_key = cache_key_from_url(url, params, kwargs.get('cache_key'))
   response  = cache.load(cache_key)
+  ttl       = kwargs.get('ttl', 300)
+  depth     = kwargs.get('stats_depth')
+
+  if response is not None:
+    cache.stats.hit(cache_key, depth)
+
+  if response is None and kwargs.get('stale'):
+    response = cache.load(cache_key, kwargs.get('stale'))
+
+    if response is not None:
+      cache.stats.stale(cache_key, depth)
+      revalidate_request(url, cache, cache_key, params, callback, ttl, depth)
 
   if response is None:
-    try:
-      response = get(url, params=params)
+    cache.stats.miss(cache_key, depth)
+    response = single_flight(cache_key, fetch_request, url, cache, cache_key, params, callback, ttl, depth)
 
-      if response.status_code != 200:
-        return None
+  if response is None:
+    return None
 
-      response = response.text if callback is None else callback(response.text)
-      response = cache.save(cache_key, response, kwargs.get('ttl', 300))
-    except socket.error:
-      return None
+  if kwargs.get('json'):
+    return response.json
+
+  if kwargs.get('html'):
+    return response.html
+
+  return response.text
+
+
+def fetch_request(url, cache, cache_key, params=None, callback=None, ttl=300, depth=None):
+  if cache.failed(cache_key):
+    return None
+
+  stale = cache.get(cache_key)
+  start = time.monotonic()
+
+  try:
+    headers  = request_validators(stale)
+    response = http_get(url, params=params, headers=headers)
+  except DeadlineExceeded:
+    return None
+  except socket.error:
+    if deadline_remaining() != 0:
+      cache.fail(cache_key)
+
+    return None
+  finally:
+    cache.stats.fetch(cache_key, time.monotonic() - start, depth)
+
+  if response.status_code == 304 and stale is not None:
+    cache.clear_failure(cache_key)
+    return cache.refresh(stale, ttl)
+
+  if response.status_code != 200:
+    cache.fail(cache_key)
+    return None
+
+  validators = response_validators(response)
+  response   = response.text if callback is None else callback(response.text)
+  response   = cache.save(cache_key, response, ttl, **validators)
+
+  cache.clear_failure(cache_key)
 
-  response = response.json if kwargs.get('json') else response.text
   return response
 
 
+def revalidate_request(url, cache, cache_key, params=None, callback=None, ttl=300, depth=None):
+  with REVALIDATE_LOCK:
+    if cache_key in REVALIDATE_KEYS:
+      return
+
+    REVALIDATE_KEYS.add(cache_key)
+
+  def revalidate():
+    try:
+      single_flight(cache_key, fetch_request, url, cache, cache_key, params, callback, ttl, depth)
+    finally:
+      with REVALIDATE_LOCK:
+        REVALIDATE_KEYS.discard(cache_key)
+
+  run_task(revalidate, lane='background')
+
+
+def request_validators(item):
+  headers = {}
+
+  if getattr(item, 'etag', None):
+    headers['If-None-Match'] = item.etag
+
+  if getattr(item, 'modified', None):
+    headers['If-Modified-Since'] = item.modified
+
+  return headers
+
+
+def response_validators(response):
+  validators = {
+    'etag':     response.headers.get('ETag'),
+    'modified': response.headers.get('Last-Modified')
+  }
+
+  return validators
+
+
 def cache_key_from_url(url, params=None, cache_key=None):
   key = url.split('://')[1]
 
@@ -254,21 +542,85 @@ def parse_url(url, base_url=None):
   return url
 
 
-def download_file(url, path, stream=False):
+def download_file(url, path, max_size=5 * 1024 * 1024, content_types=None, checksum=False):
+  path   = os.path.normpath(path)
+  folder = os.path.dirname(path)
+
   try:
-    response = get(url, stream=stream)
-    path     = os.path.normpath(path)
-    folder   = os.path.dirname(path)
+    response = http_get(url, stream=True)
+  except socket.error:
+    return None
+
+  with response:
+    temp = None
+
+    try:
+      if response.status_code != 200:
+        return None
+
+      if not valid_content_type(response, content_types):
+        return None
+
+      if int(response.headers.get('Content-Length') or 0) > max_size:
+        return None
+
+      if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+      handle, temp = tempfile.mkstemp(dir=folder, prefix='.download-')
+      digest       = hashlib.sha1()
+      size         = 0
+
+      with os.fdopen(handle, 'wb') as filename:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+          size = size + len(chunk)
+
+          if size > max_size:
+            raise ValueError('Download exceeds size limit')
+
+          digest.update(chunk)
+          filename.write(chunk)
+
+      if checksum and file_checksum(path) == digest.hexdigest() and os.path.exists(path):
+        os.remove(temp)
+        return path
+
+      os.chmod(temp, 0o666 & ~FILE_UMASK)
+      os.replace(temp, path)
+
+      if checksum:
+        save_checksum(path, digest.hexdigest())
+    except (socket.error, ValueError):
+      if temp is not None and os.path.exists(temp):
+        os.remove(temp)
 
-    if response.status_code != 200:
       return None
 
-    if not os.path.exists(folder):
-      os.makedirs(folder)
+  return path
 
-    with open(path, 'wb') as filename:
-      filename.write(response.content)
-  except socket.error:
+
+def valid_content_type(response, content_types=None):
+  if not content_types:
+    return True
+
+  ctype = str(response.headers.get('Content-Type', '')).lower()
+  valid = any(ctype.startswith(item) for item in content_types)
+
+  return valid
+
+
+def checksum_path(path):
+  return "%s.sha1" % path
+
+
+def file_checksum(path):
+  try:
+    with open(checksum_path(path)) as filename:
+      return filename.read().strip()
+  except OSError:
     return None
 
-  return path
+
+def save_checksum(path, digest):
+  with open(checksum_path(path), 'w') as filename:
+    filename.write(digest)
@@ -31,6 +31,7 @@ class KickoffPlayer(object):
 
     self.argparse = argparse.ArgumentParser(prog='kickoff-player')
     self.argparse.add_argument('url', metavar='URL', nargs='?', default=None)
+    self.argparse.add_argument('--cache-stats', metavar='PATH', default=None)
 
     self.cache = cache
     self.data  = data
@@ -57,6 +58,7 @@ class KickoffPlayer(object):
 
     GLib.timeout_add(2000, self.toggle_reload, True)
     self.open_stream_url()
+    self.dump_cache_stats()
 
   def run(self):
     self.window.show_all()
@@ -75,6 +77,12 @@ class KickoffPlayer(object):
 
       self.set_stack_visible_child(self.player_stack)
 
+  def dump_cache_stats(self):
+    path = self.argparse.parse_args().cache_stats
+
+    if path is not None:
+      self.cache.stats.dump_on_exit(path)
+
   def toggle_reload(self, show):
     self.header_reload.set_sensitive(show)
 
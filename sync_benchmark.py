@@ -0,0 +1,112 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+IGNORE_PARAMS = ['since', 'utc_offset']
+
+
+def parse_args():
+  args = argparse.ArgumentParser(prog='sync-benchmark')
+  args.add_argument('fixtures', metavar='FIXTURES')
+  args.add_argument('--record', action='store_true', default=False)
+  args.add_argument('--latency', type=float, default=0.0)
+  args.add_argument('--jitter', type=float, default=0.0)
+  args.add_argument('--home', metavar='PATH', default=None)
+  args.add_argument('--explain', action='store_true', default=False)
+
+  return args.parse_args()
+
+
+def count_statements(dbs, counter):
+  execute = dbs.execute_sql
+
+  def execute_sql(sql, *args, **kwargs):
+    if not sql.lstrip().upper().startswith(('SELECT', 'PRAGMA')):
+      counter['statements'] = counter['statements'] + 1
+
+    return execute(sql, *args, **kwargs)
+
+  dbs.execute_sql = execute_sql
+
+
+def run_step(name, callback, data, timings):
+  start = time.monotonic()
+  callback()
+  data.flush()
+  timings.append((name, time.monotonic() - start))
+
+
+def print_query_plans(data):
+  plans = data.explain_queries()
+
+  for name, plan in sorted(plans.items()):
+    print(name)
+
+    for line in plan:
+      print("  %s" % line)
+
+  for scan in data.full_scans(plans):
+    print("full scan: %s" % scan)
+
+
+def main():
+  args = parse_args()
+  home = args.home or tempfile.mkdtemp(prefix='kickoff-benchmark-')
+
+  os.environ['HOME'] = home
+  sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+  from helpers.utils import mount_http_adapter
+  from helpers.replay import RecordAdapter, ReplayAdapter
+  from handlers.data import DataHandler
+  from handlers.cache import CacheHandler
+  from apis.scores import ScoresApi
+  from apis.streams import StreamsApi
+
+  if args.record:
+    adapter = RecordAdapter(args.fixtures, IGNORE_PARAMS)
+  else:
+    adapter = ReplayAdapter(args.fixtures, args.latency, args.jitter, IGNORE_PARAMS)
+
+  mount_http_adapter(adapter)
+
+  counter = { 'statements': 0 }
+  cache   = CacheHandler(evict_interval=0)
+  data    = DataHandler(prune_interval=0)
+
+  count_statements(data.dbs, counter)
+
+  scores  = ScoresApi(data, cache)
+  streams = StreamsApi(data, cache)
+  timings = []
+  start   = time.monotonic()
+
+  run_step('save_competitions', scores.save_competitions, data, timings)
+  run_step('save_teams', scores.save_teams, data, timings)
+  run_step('save_matches', scores.save_matches, data, timings)
+  run_step('save_live', scores.save_live, data, timings)
+  run_step('save_channels', streams.save_channels, data, timings)
+  run_step('save_events', streams.save_events, data, timings)
+
+  total = time.monotonic() - start
+
+  for name, seconds in timings:
+    print("%-20s %8.3fs" % (name, seconds))
+
+  print("%-20s %8.3fs" % ('wall time', total))
+  print("%-20s %8d" % ('requests', adapter.requests))
+  print("%-20s %8d" % ('write statements', counter['statements']))
+
+  if not args.record:
+    print("%-20s %8d" % ('missing fixtures', adapter.misses))
+
+  if args.explain:
+    print_query_plans(data)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT       = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+FULL_LISTS = ['load_settings', 'load_teams']
+
+
+class QueryPlansTest(unittest.TestCase):
+
+  @classmethod
+
+  def setUpClass(cls):
+    cls.home = tempfile.mkdtemp(prefix='kickoff-tests-')
+    os.environ['HOME'] = cls.home
+
+    if ROOT not in sys.path:
+      sys.path.insert(0, ROOT)
+
+    from handlers.data import DataHandler
+    cls.data = DataHandler(prune_interval=0)
+
+  @classmethod
+
+  def tearDownClass(cls):
+    shutil.rmtree(cls.home, ignore_errors=True)
+
+  def test_queries_have_plans(self):
+    for name, plan in self.data.explain_queries().items():
+      self.assertTrue(plan, name)
+
+  def test_no_unindexed_scans(self):
+    scans = self.data.full_scans()
+    scans = [scan for scan in scans if scan.split(':')[0] not in FULL_LISTS]
+
+    self.assertEqual(scans, [])
+
+
+if __name__ == '__main__':
+  unittest.main()
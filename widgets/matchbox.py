@@ -238,7 +238,7 @@ class MatchDetailsBox(Gtk.Box):
     self.pack_end(self.more_button, False, False, 2)
 
   def on_fixture_updated(self, *_args):
-    self.event_count = getattr(self.fixture, 'events').count()
+    self.event_count = getattr(self.fixture, 'events_count')
     self.update_count_label()
     self.update_more_button()
 